@@ -1,26 +1,85 @@
-from time import sleep, time
+import os
+import json
+import logging
+from time import time
 
-from datetime import datetime, timedelta
+from datetime import datetime
 from collections import namedtuple
 import pandas as pd
 
 from selenium.webdriver import Firefox
 from selenium.webdriver.firefox.options import Options
+from selenium.webdriver.firefox.service import Service
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.common.action_chains import ActionChains as AC
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.common.keys import Keys
+from selenium.common.exceptions import StaleElementReferenceException, InvalidCookieDomainException, \
+    TimeoutException, NoSuchElementException
 
-DateAvail = namedtuple("DateAvail", ["element", "date", "available"])
+logger = logging.getLogger(__name__)
+
+# columns of the calendar scan, stored as parallel lists
+DateAvail = namedtuple("DateAvail", ["month_id", "position", "date", "available"])
+
+def availability_frame(availability: DateAvail) -> pd.DataFrame:
+    """
+    Build the DataFrame of a calendar scan from its columns.
+
+    Parameters
+    ----------
+    availability: DateAvail
+        Parallel lists of month header ids, positions of the day buttons
+        within the months, dates and availability states
+
+    Returns
+    -------
+    availability_df: DataFrame
+        DataFrame containing the month header id, the position of the day
+        button within the month and the availability state for each datum.
+        The DataFrame is indexed by date.
+    """
+    return pd.DataFrame(
+        {
+            "month_id": availability.month_id,
+            "position": availability.position,
+            "available": availability.available
+        },
+        index=pd.DatetimeIndex(availability.date, name="date")
+    )
+
+class _LOC():
+    """
+    Locators of the elements of the Meta Data for Good webpage, defined once
+    as `(By, value)` tuples.
+    """
+    ALLOW_COOKIES = (By.CSS_SELECTOR, "button[title='Only allow essential cookies']")
+    LOG_IN = (By.LINK_TEXT, "Log In")
+    EMAIL = (By.CSS_SELECTOR, "#email")
+    PASSWORD = (By.CSS_SELECTOR, "#pass")
+    LOGIN_BUTTON = (By.CSS_SELECTOR, "#loginbutton")
+    DISCONTINUED = (By.XPATH, "//div[text()='Show discontinued datasets']")
+    SEARCH = (By.CSS_SELECTOR, "input[placeholder='Find datasets by name']")
+    DATASET_TYPE = (By.XPATH, "((//*[text()='Dataset type'])[1]//following::input)[1]")
+    COUNTRY = (By.XPATH, "((//*[text()='Paese'])[1]//following::input)[1]")
+    SCARICA = (By.XPATH, "//a[text()='Scarica']")
+    DATE_INTERVAL = (By.XPATH, "//div[text()='Intervallo di date']")
+    CALENDAR = (By.XPATH, "(//div[text()='Intervallo di date']//following::span)[1]")
+    MONTH = (By.CSS_SELECTOR, "h2[id*='js_']")
+    PREV_MONTH = (By.XPATH, "(//div[text()='Mese precedente']//following::div)[1]")
+    AGGIORNA = (By.XPATH, "//div[text()='Aggiorna']")
+    DOWNLOAD_FILES = (By.XPATH, "//div[text()='Download files']")
 
 class Dataset():
     """
     The `Dataset` class serves as the main object in order to interact with the
     **bulk downloader tool**. When it is initiated, a Firefox WebDriver will be
-    started in headless mode and the Meta Data for Good webpage will be opened.
+    started (by default in headless mode) and the Meta Data for Good webpage
+    will be opened.
     """
-    def __init__(self, starting_url: str, dest_folder: str):
+    def __init__(self, starting_url: str, dest_folder: str, profile_path: str = None,
+        headless: bool = True, driver_path: str = None):
         """
         Instantiate a `Dataset` object.
 
@@ -30,18 +89,48 @@ class Dataset():
             URL of the Meta Data for Good webpage
         dest_folder: str
             Path of the destination folder as a string
+        profile_path: str
+            Path of a persistent Firefox profile folder as a string. When it is
+            provided, cookies and the login session are kept across runs,
+            otherwise a fresh temporary profile is used
+        headless: bool
+            Whether to run Firefox in headless mode. This option is defaulted
+            to True, set it to False to watch the browser while debugging
+        driver_path: str
+            Path of the `geckodriver` executable as a string. If it is not
+            provided, `geckodriver` is looked up in the PATH
         """
         options = Options()
-        options.headless = True
+        if headless:
+            options.add_argument("--headless")
+        # do not wait for images and stylesheets when loading a page: every
+        # interaction with the page waits explicitly for its elements
+        options.page_load_strategy = "eager"
+        if profile_path is not None:
+            options.add_argument("-profile")
+            options.add_argument(profile_path)
         options.set_preference("browser.download.folderList", 2)
         options.set_preference("browser.download.manager.showWhenStarting", False)
         options.set_preference("browser.download.dir", dest_folder)
         options.set_preference("browser.helperApps.neverAsk.saveToDisk", "application/zip")
-        self.browser = Firefox(options=options)
+        options.set_preference("network.http.max-persistent-connections-per-server", 16)
+        # images are never needed, a single content process and no disk cache
+        # keep startup time and memory low
+        options.set_preference("permissions.default.image", 2)
+        options.set_preference("dom.ipc.processCount", 1)
+        options.set_preference("browser.cache.disk.enable", False)
+        service = Service() if driver_path is None else Service(executable_path=driver_path)
+        self.browser = Firefox(service=service, options=options)
+        # let the commands sent to the driver share a pool of keep-alive
+        # connections instead of reopening them when more are in flight
+        connection_manager = self.browser.command_executor._conn
+        connection_manager.connection_pool_kw["maxsize"] = 10
+        connection_manager.clear()
         self.browser.get(starting_url)
         self.dest_folder = dest_folder
+        self._element_cache = {}
     
-    def wait_element(self, element):
+    def wait_element(self, element, timeout: float = 10):
         """
         Wait that an element is ready for interaction.
 
@@ -49,12 +138,14 @@ class Dataset():
         ----------
         element: selenium.webdriver.remote.webelement.WebElement
             Element that we are waiting for
+        timeout: float
+            Maximum number of seconds to wait for
         """
-        WebDriverWait(self.browser, 10).until(
+        WebDriverWait(self.browser, timeout).until(
             EC.element_to_be_clickable(element)
         )
     
-    def wait_and_click(self, element):
+    def wait_and_click(self, element, timeout: float = 10):
         """
         Wait an element and when it is ready, click on it.
 
@@ -62,28 +153,175 @@ class Dataset():
         ----------
         element: selenium.webdriver.remote.webelement.WebElement
             Element that we are waiting for
+        timeout: float
+            Maximum number of seconds to wait for
         """
-        self.wait_element(element)
+        self.wait_element(element, timeout)
         element.click()
+
+    def find_cached(self, locator: tuple, refresh: bool = False):
+        """
+        Find an element and keep it in a cache, so that elements that persist
+        in the page are looked up only once.
+
+        Parameters
+        ----------
+        locator: tuple
+            Locator of the element as a `(By, value)` tuple
+        refresh: bool
+            Whether to look up the element again even if it is cached (i.e.
+            because the cached element has gone stale)
+
+        Returns
+        -------
+        element: selenium.webdriver.remote.webelement.WebElement
+            The (possibly cached) element
+        """
+        if refresh or locator not in self._element_cache:
+            self._element_cache[locator] = self.browser.find_element(*locator)
+        return self._element_cache[locator]
+
+    def click_cached(self, locator: tuple):
+        """
+        Wait a cached element and click on it, looking it up again only if the
+        cached element has gone stale.
+
+        Parameters
+        ----------
+        locator: tuple
+            Locator of the element as a `(By, value)` tuple
+        """
+        try:
+            self.wait_and_click(self.find_cached(locator))
+        except StaleElementReferenceException:
+            self.wait_and_click(self.find_cached(locator, refresh=True))
+
+    def find_many(self, *locators: tuple, optional: bool = False) -> list:
+        """
+        Find the first element matching each of the given locators with a single
+        script execution, instead of issuing one WebDriver command per lookup.
+        CSS selectors are resolved with `querySelector`, XPath expressions with
+        `document.evaluate`.
+
+        Parameters
+        ----------
+        locators: tuple
+            Locators of the elements as `(By.CSS_SELECTOR, value)` or
+            `(By.XPATH, value)` tuples
+        optional: bool
+            Whether the elements may be missing. If not (the default), a
+            `NoSuchElementException` is raised when any of them is not found
+
+        Returns
+        -------
+        elements: list
+            List of the elements (`None` where nothing matches, if `optional`),
+            in the same order as `locators`
+        """
+        elements = self.browser.execute_script("""
+            return arguments[0].map(([by, value]) => by === "css selector"
+                ? document.querySelector(value)
+                : document.evaluate(
+                    value, document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null
+                ).singleNodeValue
+            );
+        """, [list(locator) for locator in locators])
+        missing = [locator for locator, element in zip(locators, elements) if element is None]
+        if missing and not optional:
+            raise NoSuchElementException(f"Unable to locate elements: {missing}")
+        return elements
     
     def allow_cookies(self):
         """
         Check whether the cookie dialog box has popped up, and in case click the
-        accept button.
+        accept button. If the dialog box is not there, nothing is done, so this
+        method can be safely called more than once.
         """
+        allow_cookies_btns = self.browser.find_elements(*_LOC.ALLOW_COOKIES)
+        if not allow_cookies_btns:
+            return
         try:
-            allow_cookies_btn = self.browser \
-                .find_element(By.XPATH, "//button[@title='Only allow essential cookies']")
-            self.wait_and_click(allow_cookies_btn)
-        except:
+            self.wait_and_click(allow_cookies_btns[0], timeout=2)
+        except TimeoutException:
             pass
     
+    def is_logged_in(self) -> bool:
+        """
+        Check whether the user is already logged in (i.e. because the session
+        has been restored from a persistent profile), waiting for the starting
+        page to show either the login link or the dataset search field.
+
+        Returns
+        -------
+        logged_in: bool
+            Whether the user is already logged in
+        """
+        WebDriverWait(self.browser, 10).until(
+            EC.any_of(
+                EC.presence_of_element_located(_LOC.LOG_IN),
+                EC.presence_of_element_located(_LOC.SEARCH)
+            )
+        )
+        return not self.browser.find_elements(*_LOC.LOG_IN)
+
+    def save_cookies(self, cookies_path: str):
+        """
+        Save the cookies of the current session to a JSON file, so that the
+        session can be restored by `load_cookies` in the following runs. The
+        cookies give access to the account, so the file is only readable by
+        its owner.
+
+        Parameters
+        ----------
+        cookies_path: str
+            Path of the cookies file as a string
+        """
+        fd = os.open(cookies_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as f:
+            # the mode above only applies to new files
+            os.chmod(cookies_path, 0o600)
+            json.dump(self.browser.get_cookies(), f)
+
+    def load_cookies(self, cookies_path: str, max_age: float = 24 * 60 * 60) -> bool:
+        """
+        Restore the cookies saved by `save_cookies` and reload the page, if the
+        cookies file exists and is recent enough. Whether the restored session
+        is still valid should then be checked with `is_logged_in`.
+
+        Parameters
+        ----------
+        cookies_path: str
+            Path of the cookies file as a string
+        max_age: float
+            Maximum age of the cookies file in seconds (by default one day)
+
+        Returns
+        -------
+        restored: bool
+            Whether the cookies have been restored
+        """
+        if not os.path.exists(cookies_path) or time() - os.path.getmtime(cookies_path) > max_age:
+            return False
+        try:
+            with open(cookies_path) as f:
+                cookies = json.load(f)
+        except ValueError:
+            # not a cookies file (i.e. saved by an older version), log in again
+            return False
+        for cookie in cookies:
+            try:
+                self.browser.add_cookie(cookie)
+            except InvalidCookieDomainException:
+                pass
+        self.browser.refresh()
+        return True
+
     def visit_login(self):
         """
         Visit the login page from the starting page.
         """
         visit_login_btn = self.browser \
-            .find_element(By.LINK_TEXT, "Log In")
+            .find_element(*_LOC.LOG_IN)
         self.wait_and_click(visit_login_btn)
 
     def fill_field(element, text):
@@ -99,10 +337,10 @@ class Dataset():
         """
         element.send_keys(text)
     
-    def perform_login(self, username, password):
+    def perform_login(self, username, password, timeout: float = 60):
         """
         Takes username and password as inputs and logs into the Meta Data for
-        Good Platform.
+        Good Platform, returning once the login has been completed.
 
         Parameters
         ----------
@@ -112,13 +350,23 @@ class Dataset():
             the PI if you need this approval.
         password: str
             Password of the Facebook user.
+        timeout: float
+            Maximum number of seconds to wait for the login to be completed
         """
-        username_field = self.browser.find_element(By.ID, "email")
-        password_field = self.browser.find_element(By.ID, "pass")
-        login_btn = self.browser.find_element(By.ID, "loginbutton")
+        # wait for the login form to be rendered
+        WebDriverWait(self.browser, 10).until(
+            EC.presence_of_element_located(_LOC.EMAIL)
+        )
+        username_field, password_field, login_btn = self.find_many(
+            _LOC.EMAIL, _LOC.PASSWORD, _LOC.LOGIN_BUTTON
+        )
         username_field.send_keys(username)
         password_field.send_keys(password)
         login_btn.click()
+        # the login is completed once the platform shows the dataset search
+        WebDriverWait(self.browser, timeout).until(
+            EC.presence_of_element_located(_LOC.SEARCH)
+        )
     
     def filter_ds(self, search_term: str, dataset_type: str = None,
         country: str = None, discontinued: str = True):
@@ -140,15 +388,13 @@ class Dataset():
             option is defaulted to True, in order to have the widest variety of
             datasets available
         """
-        sleep(5)
-        discontinued_checkbox = self.browser \
-            .find_element(By.XPATH, "//div[text()='Show discontinued datasets']")
-        search_field = self.browser \
-            .find_element(By.XPATH, "//input[@placeholder='Find datasets by name']")
-        dstype_field = self.browser \
-            .find_element(By.XPATH, "((//*[text()='Dataset type'])[1]//following::input)[1]")
-        country_field = self.browser \
-            .find_element(By.XPATH, "((//*[text()='Paese'])[1]//following::input)[1]")
+        # wait for the filters panel to be rendered
+        discontinued_checkbox = WebDriverWait(self.browser, 10).until(
+            EC.presence_of_element_located(_LOC.DISCONTINUED)
+        )
+        search_field, dstype_field, country_field = self.find_many(
+            _LOC.SEARCH, _LOC.DATASET_TYPE, _LOC.COUNTRY
+        )
         self.wait_element(discontinued_checkbox)
         self.wait_element(search_field)
         search_field.send_keys(search_term)
@@ -159,26 +405,78 @@ class Dataset():
             dstype_field.send_keys(Keys.RETURN)
         if country is not None:
             country_field.send_keys(country)
-            country.send_keys(Keys.RETURN)
+            country_field.send_keys(Keys.RETURN)
     
     def open_dl_dialog(self):
         """
         Open the download dialog from the search result interface.
         """
-        # should wait for the search result to be ready
-        sleep(1)
-        open_dl_link = self.browser \
-            .find_element(By.XPATH, "//a[text()='Scarica']")
-        self.wait_and_click(open_dl_link)
+        # wait for the search result to be ready
+        open_dl_link = WebDriverWait(self.browser, 10).until(
+            EC.element_to_be_clickable(_LOC.SCARICA)
+        )
+        open_dl_link.click()
     
     def open_calendar(self):
         """
         Open the calendar panel from the download dialog box.
         """
         calendar_btn = self.browser \
-            .find_element(By.XPATH, "(//div[text()='Intervallo di date']//following::span)[1]")
+            .find_element(*_LOC.CALENDAR)
         self.wait_and_click(calendar_btn)
 
+    def reopen_calendar(self):
+        """
+        Make the calendar panel visible again (i.e. after a download has been
+        started), reopening only what has been closed: nothing if the calendar
+        is still open, only the calendar if the download dialog is still open,
+        both the download dialog and the calendar otherwise.
+        """
+        calendar_month_h2, date_interval_div = self.find_many(
+            _LOC.MONTH, _LOC.DATE_INTERVAL, optional=True
+        )
+        if calendar_month_h2 is not None:
+            return
+        if date_interval_div is None:
+            self.open_dl_dialog()
+        self.open_calendar()
+
+    def read_visible_dates(self) -> DateAvail:
+        """
+        Read visible dates. When using the calendar panel, read the text and
+        the state of the visible day buttons and returns them as columns.
+
+        Returns
+        -------
+        availability: DateAvail
+            Parallel lists containing the month header id, the position of the
+            day button within the month, the date and the availability state
+            for each visible datum.
+        """
+        # fetch the month headers together with the text and the state of their
+        # day buttons in one go; the buttons of each month are the ones under
+        # the container of its header, counted as `click_date` counts them
+        calendar_months = self.browser.execute_script("""
+            return Array.from(document.querySelectorAll("h2[id*='js_']"), h2 => [
+                h2.id,
+                Array.from(h2.parentElement.querySelectorAll("div[role='button']"), day => [
+                    day.innerText.trim(), day.getAttribute("aria-disabled")
+                ])
+            ]);
+        """)
+        availability = DateAvail([], [], [], [])
+        for month_id, days in calendar_months:
+            mmyyyy = month_id.split("-")[1:]
+            yyyy = int(mmyyyy[1])
+            mm = int(mmyyyy[0])
+            for position, (day_text, aria_disabled) in enumerate(days):
+                availability.month_id.append(month_id)
+                availability.position.append(position)
+                availability.date.append(datetime(yyyy, mm, int(day_text)))
+                # buttons are disabled (true) if the date is unavailable and viceversa
+                availability.available.append(aria_disabled != "true")
+        return availability
+
     def scan_visible_dates(self) -> tuple[pd.DataFrame, int]:
         """
         Scan visible dates. When using the calendar panel, scan through the
@@ -189,58 +487,121 @@ class Dataset():
         Returns
         -------
         availability_df: DataFrame
-            DataFrame containing the WebDriver element and the availability state
-            for each datum. The DataFrame is indexed by date.
+            DataFrame containing the month header id, the position of the day
+            button within the month and the availability state for each datum.
+            The DataFrame is indexed by date.
         n_available_dates: int
             The integer number of dates that are available in that calendar view.
         """
-        calendar_months_h2 = self.browser \
-            .find_elements(By.XPATH, "//h2[contains(@id, 'js_')]")
-        availability_arr = []
-        for calendar_month_h2 in calendar_months_h2:
-            mmyyyy = calendar_month_h2.get_attribute("id") \
-                .split("-")[1:]
-            yyyy = mmyyyy[1].zfill(4)
-            mm = mmyyyy[0].zfill(2)
-            days_div = calendar_month_h2 \
-                .find_elements(By.XPATH, "..//child::div[@role='button']")
-            for day_div in days_div:
-                dd = day_div.text.zfill(2)
-                date = datetime.fromisoformat(f"{yyyy}-{mm}-{dd}")
-                # buttons are disabled (true) if the date is unavailable and viceversa
-                avail = False if day_div.get_attribute("aria-disabled") == "true" else True
-                availability_arr.append(
-                    DateAvail(day_div, date, avail)
-                )
-        availability_df = pd.DataFrame(availability_arr).set_index("date")
-        n_available_dates = len(availability_df.query("available==True"))
+        availability_df = availability_frame(self.read_visible_dates())
+        n_available_dates = int(availability_df["available"].sum())
         return availability_df, n_available_dates
     
-    def scan_all_dates(self) -> list:
+    def scan_all_dates(self, cache_path: str = None) -> list:
         """
         From the calendar panel, check all the available dates.
 
         Scans through and saves all the available dates, and returns the sorted list
         of available dates.
 
+        If the path of a cache file is given and the file exists, the dates that
+        have been found available by a previous scan are loaded from it, and the
+        scan stops as soon as it reaches one of them (new dates are only added
+        at the end of the time series). The cache file is then updated with the
+        result of the scan. The file is a JSON list of the available dates in
+        ISO format, so that a tampered file cannot run code when it is loaded.
+
+        Parameters
+        ----------
+        cache_path: str
+            Path of the cache file of the scan results as a string
+
         Returns
         -------
         available_dates: list
             List of available dates
         """
-        total_availability_df_arr = []
+        cached_df = None
+        cached_dates = set()
+        if cache_path is not None and os.path.exists(cache_path):
+            try:
+                with open(cache_path) as f:
+                    cached_dates = set(datetime.fromisoformat(date) for date in json.load(f))
+            except (ValueError, TypeError):
+                # not a cache file, the calendar is scanned from scratch
+                logger.warning("Ignoring the unreadable cache file %s", cache_path)
+            else:
+                cached_df = pd.DataFrame(
+                    {"available": True}, index=pd.DatetimeIndex(sorted(cached_dates), name="date")
+                )
+        # accumulate the columns of every calendar view and build the DataFrame once
+        availability = DateAvail([], [], [], [])
         n_available_dates = 1
         while (n_available_dates):
-            availability_df, n_available_dates = self.scan_visible_dates()
-            total_availability_df_arr.append(availability_df)
+            visible_availability = self.read_visible_dates()
+            for column, visible_column in zip(availability, visible_availability):
+                column.extend(visible_column)
+            n_available_dates = sum(visible_availability.available)
+            if not cached_dates.isdisjoint(visible_availability.date):
+                break
             self.goto_prev_month(2)
-        total_availability_df = pd.concat(total_availability_df_arr, axis=0)
-        available_dates = list(total_availability_df.query("available==True").index)
+        total_availability_df = availability_frame(availability)
+        if cached_df is not None:
+            total_availability_df = pd.concat([
+                total_availability_df,
+                cached_df[~cached_df.index.isin(total_availability_df.index)]
+            ])
+        available_dates = sorted(
+            total_availability_df.index[total_availability_df["available"].to_numpy()].to_pydatetime()
+        )
         self.available_dates = available_dates
-        self.available_dates.sort()
         self.total_availability_df = total_availability_df
+        if cache_path is not None:
+            with open(cache_path, "w") as f:
+                json.dump([date.date().isoformat() for date in available_dates], f)
         return available_dates
     
+    def plan_blocks(self, block_size: int, date_from: datetime = None,
+        date_to: datetime = None) -> list:
+        """
+        Split the available dates (optionally restricted to the interval between
+        `date_from` and `date_to`) in blocks of `block_size` days, going
+        backwards in time from the last available date to the first one. The
+        last block is shorter when the number of days is not a multiple of
+        `block_size`, so that it ends exactly on the first available date.
+
+        Parameters
+        ----------
+        block_size: int
+            Size of the block **in terms of days**
+        date_from: datetime.datetime
+            First date of interest, if any
+        date_to: datetime.datetime
+            Last date of interest, if any
+
+        Returns
+        -------
+        blocks: list
+            List of `(current_date, next_date)` tuples (where `next_date <=
+            current_date`) covering all the available dates of interest
+        """
+        available_dates = [
+            date for date in self.available_dates
+            if (date_from is None or date >= date_from) and (date_to is None or date <= date_to)
+        ]
+        if not available_dates:
+            return []
+        edges = list(pd.date_range(
+            start=available_dates[-1], end=available_dates[0],
+            freq=f"-{block_size}D"
+        ).to_pydatetime())
+        if edges[-1] > available_dates[0]:
+            edges.append(available_dates[0])
+        if len(edges) == 1:
+            # a single available date makes a one day block
+            return [(edges[0], edges[0])]
+        return list(zip(edges[:-1], edges[1:]))
+    
     def goto_prev_month(self, n):
         """
         From the calendar panel, move the view back of `n` months.
@@ -250,22 +611,52 @@ class Dataset():
         n: int
             Integer number of months to go back by
         """
-        # go back in the calendar by n months
-        prev_month_btn = self.browser \
-            .find_element(By.XPATH, "(//div[text()='Mese precedente']//following::div)[1]")
-        for i in range(n):
-            prev_month_btn.click()
+        first_month_id = self.first_month_id()
+        # go back in the calendar by n months, firing all the clicks from a
+        # single script
+        click_n_times = "for (let i = 0; i < arguments[1]; i++) arguments[0].click();"
+        try:
+            self.browser.execute_script(click_n_times, self.find_cached(_LOC.PREV_MONTH), n)
+        except StaleElementReferenceException:
+            self.browser.execute_script(click_n_times, self.find_cached(_LOC.PREV_MONTH, refresh=True), n)
+        # wait for the calendar to render the new months: the old header may be
+        # detached between its lookup and the reading of its id
+        WebDriverWait(self.browser, 10, ignored_exceptions=(StaleElementReferenceException,)).until(
+            lambda _: self.first_month_id() != first_month_id
+        )
+
+    def first_month_id(self) -> str:
+        """
+        From the calendar panel, get the id of the first visible month header.
+        The id changes whenever the calendar view is moved, so it can be used to
+        detect when the new months have been rendered.
+
+        Returns
+        -------
+        month_id: str
+            The `id` attribute of the first visible `h2` month header
+        """
+        return self.browser \
+            .find_element(*_LOC.MONTH) \
+            .get_attribute("id")
     
-    def send_escape(self):
+    def send_escape(self, times: int = 1):
         """
         Send an escape signal to the browser. Useful to get out of dialog boxes.
+
+        Parameters
+        ----------
+        times: int
+            Number of escape signals to be sent (i.e. 2 to get out of a panel
+            opened inside a dialog box). All of them are sent with a single
+            action sequence
         """
-        AC(self.browser).send_keys(Keys.ESCAPE).perform()
+        AC(self.browser).send_keys(*[Keys.ESCAPE] * times).perform()
 
     def choose_date_interval(self, current_date: datetime, next_date: datetime) -> pd.DataFrame:
         """
         From the calendar panel, select (i.e. click) the correct interval of dates
-        between `next_date` and `current_date` (where `next_date < current_date`,
+        between `next_date` and `current_date` (where `next_date <= current_date`,
         because the scan is performed backwards in time).
 
         Parameters
@@ -278,24 +669,68 @@ class Dataset():
         Returns
         -------
         availability_df: DataFrame
-            DataFrame containing the WebDriver element and the availability state
-            for each datum. The DataFrame is indexed by date.
+            DataFrame containing the month header id, the position of the day
+            button within the month and the availability state for each datum.
+            The DataFrame is indexed by date.
+        """
+        # the blocks that have been skipped may have left the view several
+        # months after the interval, so the calendar is paged back as needed
+        availability_df = self.show_date(current_date)
+        self.click_date(availability_df.loc[current_date])
+        availability_df = self.show_date(next_date)
+        self.click_date(availability_df.loc[next_date])
+        return availability_df
+
+    def show_date(self, date: datetime) -> pd.DataFrame:
+        """
+        From the calendar panel, move the view back until `date` is visible.
+        The number of months to go back by is computed from the first visible
+        date, so that dates several months before the view are reached with a
+        single jump.
+
+        Parameters
+        ----------
+        date: datetime.datetime
+            Datetime object of the date to be shown
+
+        Returns
+        -------
+        availability_df: DataFrame
+            DataFrame returned by `scan_visible_dates` for the view showing
+            `date`
         """
-        # what are the visible dates?
         availability_df, _ = self.scan_visible_dates()
-        # now select the current date and the next date
-        try:
-            availability_df.loc[current_date].element.click()
-            availability_df.loc[next_date].element.click()
-        except KeyError:
-            self.goto_prev_month(1)
+        while date not in availability_df.index:
+            first_visible_date = availability_df.index.min()
+            n = (first_visible_date.year - date.year) * 12 + first_visible_date.month - date.month
+            if n <= 0:
+                # the calendar is only paged backwards
+                raise KeyError(f"{date} cannot be reached from the calendar view")
+            self.goto_prev_month(n)
             availability_df, _ = self.scan_visible_dates()
-            availability_df.loc[next_date].element.click()
-            # I don't know why this should not be selected but it works like this so...
-            # availability_df.loc[current_date].element.click()
         return availability_df
 
-    def download_iteration(self, block_size: int):
+    def click_date(self, date_avail: pd.Series):
+        """
+        From the calendar panel, click on the button of a date that has been
+        scanned by `scan_visible_dates`. The button element is looked up only
+        at this point, so that the scan does not have to fetch one element per
+        visible date.
+
+        Parameters
+        ----------
+        date_avail: pandas.Series
+            Row of the DataFrame returned by `scan_visible_dates` corresponding
+            to the date to be clicked
+        """
+        day_div = self.browser.find_element(
+            By.XPATH,
+            f"(//h2[@id='{date_avail.month_id}']/..//div[@role='button'])[{date_avail.position + 1}]"
+        )
+        day_div.click()
+
+    def download_iteration(self, block_size: int, parallel_downloads: int = 1,
+        date_from: datetime = None, date_to: datetime = None, skip_dates: set = None):
         """
         This function contains the main function that performs the iteration over
         the blocks and downloads the datasets.
@@ -309,7 +744,12 @@ class Dataset():
         dataset.
 
         The check of the completion of the download happens with a polling of the
-        previously opened `about:downloads` page.
+        previously opened `about:downloads` page. Up to `parallel_downloads`
+        blocks can be downloading at the same time: the downloads started so far
+        are counted, and a new download is started only once all of them are
+        listed in the download page and one of them has been completed. A
+        download that has been requested but is not listed yet is therefore
+        still taken as active.
 
         Parameters
         ----------
@@ -320,52 +760,124 @@ class Dataset():
             of the user to choose a reasonable number, since too big of a number
             of datasets will make the website crash and unable to download the
             data.
+        parallel_downloads: int
+            Maximum number of blocks that are downloaded at the same time
+        date_from: datetime.datetime
+            First date to be downloaded, if not the first available date
+        date_to: datetime.datetime
+            Last date to be downloaded, if not the last available date
+        skip_dates: set
+            Dates that have already been downloaded. The blocks whose available
+            dates have all been downloaded are skipped
+
+        Returns
+        -------
+        failed_blocks: list
+            List of the `(current_date, next_date)` tuples of the blocks whose
+            download has failed or has been canceled
         """
-        start = time()
         # open the download tab
         self.browser.execute_script("window.open('');")
         self.browser.switch_to.window(self.browser.window_handles[1])
         self.browser.get("about:downloads")
+        # entries already listed by the profile, the downloads started by this
+        # iteration are counted on top of them
+        expected_downloads = len(self.browser.find_elements(By.CSS_SELECTOR, ".download"))
+        previous_downloads = expected_downloads
         self.browser.switch_to.window(self.browser.window_handles[0])
         # open the download dialog box
         self.open_dl_dialog()
         self.open_calendar()
-        # starting values of the iteration
-        current_date = self.available_dates[-1]
-        next_date = current_date - timedelta(days=block_size)
-        while (next_date > self.available_dates[0]):
-            print(f"[LOG] Downloading data between {next_date} and {current_date} (time elapsed: {time()-start:.2f} s)...")
+        download_pending = False
+        started_blocks = []
+        blocks = self.plan_blocks(block_size, date_from, date_to)
+        if not blocks:
+            logger.warning("There are no available dates between %s and %s", date_from, date_to)
+        for current_date, next_date in blocks:
+            if skip_dates and all(
+                date in skip_dates for date in self.available_dates
+                if next_date <= date <= current_date
+            ):
+                logger.info("Skipping data between %s and %s, already downloaded", next_date, current_date)
+                continue
+            logger.info("Downloading data between %s and %s...", next_date, current_date)
+            if download_pending:
+                # prepare the dialog for this block while the download goes on
+                self.reopen_calendar()
             _ = self.choose_date_interval(current_date=current_date, next_date=next_date)
-            update_btn = self.browser \
-                .find_element(By.XPATH, "//div[text()='Aggiorna']")
-            self.wait_and_click(update_btn)
-            download_btn = self.browser \
-                .find_element(By.XPATH, "//div[text()='Download files']")
-            self.wait_and_click(download_btn)
-
-            current_date = next_date
-            next_date = current_date - timedelta(days=block_size)
-            # print("[DEBUG] Current date:", current_date)
-            # print("[DEBUG] Next date:", next_date)
-            # now wait for the download to finish
-            self.browser.switch_to.window(self.browser.window_handles[1])
-            self.dl_check()
-            self.browser.switch_to.window(self.browser.window_handles[0])
-            self.open_dl_dialog()
-            self.open_calendar()
-        # in the latter case, we should set the beginning of this dataset
-        # time interval to be the last available date (i.e. the smallest)
-        self.goto_prev_month(1)
-        self.choose_date_interval(current_date, self.available_dates[0])
-    
-    def dl_check(self):
+            # the interval has been set while the previous blocks were
+            # downloading, only now we have to wait for a download slot
+            if download_pending:
+                self.wait_downloads(expected_downloads, parallel_downloads - 1)
+            self.click_cached(_LOC.AGGIORNA)
+            self.click_cached(_LOC.DOWNLOAD_FILES)
+            expected_downloads += 1
+            started_blocks.append((current_date, next_date))
+            download_pending = True
+        failed_blocks = []
+        if download_pending:
+            states = self.wait_downloads(expected_downloads)
+            # the entries of this iteration follow the ones listed before it
+            for (current_date, next_date), state in zip(started_blocks, states[previous_downloads:]):
+                if state != "1":
+                    logger.warning("The download of data between %s and %s has failed", next_date, current_date)
+                    failed_blocks.append((current_date, next_date))
+        return failed_blocks
+
+    def wait_downloads(self, expected: int, max_active: int = 0):
         """
-        Check whether there are active download processes.
+        Focus on the download page opened by `download_iteration`, wait until
+        at most `max_active` downloads are still active and focus back to the
+        previous page.
+
+        Parameters
+        ----------
+        expected: int
+            Number of entries that the download page has to list, i.e. the
+            downloads that have been started so far
+        max_active: int
+            Number of downloads that may still be active
+
+        Returns
+        -------
+        states: list
+            States of the entries of the download page, as returned by
+            `dl_check`
         """
-        while True:
-            download_elements = self.browser.find_elements(By.CSS_SELECTOR, ".download")
-            download_states = [bool(download_element.get_attribute("state")) for download_element in download_elements]
-            if any(download_states) is False:
-                sleep(1)
-            else:
-                break
\ No newline at end of file
+        self.browser.switch_to.window(self.browser.window_handles[1])
+        states = self.dl_check(expected, max_active)
+        self.browser.switch_to.window(self.browser.window_handles[0])
+        return states
+    
+    def dl_check(self, expected: int, max_active: int = 0):
+        """
+        Wait until the `about:downloads` page lists at least `expected` entries
+        and there are at most `max_active` active download processes among
+        them. Waiting for the entries makes sure that a download that has just
+        been requested, but is not listed yet, is not taken as completed.
+
+        Parameters
+        ----------
+        expected: int
+            Number of entries that the download page has to list
+        max_active: int
+            Number of downloads that may still be active
+
+        Returns
+        -------
+        states: list
+            States of the entries, from the oldest to the newest download
+        """
+        # states of the entries: -1 not started, 0 downloading, 4 paused,
+        # 5 queued; every other state is final (1 finished, 2 failed,
+        # 3 canceled). The page lists the newest download first
+        return WebDriverWait(self.browser, 3600, poll_frequency=0.5).until(
+            lambda browser: browser.execute_script("""
+                const states = Array.from(
+                    document.querySelectorAll(".download"), download => download.getAttribute("state")
+                ).reverse();
+                const active = states.filter(state => ["-1", "0", "4", "5"].includes(state));
+                return states.length >= arguments[0] && active.length <= arguments[1]
+                    ? {states: states} : false;
+            """, expected, max_active)
+        )["states"]
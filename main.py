@@ -6,14 +6,32 @@ time interval of interest are provided, then files are downloaded.
 There should also be an .env file in the same folder of the script, containing
 the environment variables that define the Meta Data for Good Partner ID
 `FBDFG_PID`, the Facebook username `FBDFG_USER`, the Facebook password
-`FBDFG_PASS` and the download folder path `DOWNLOAD_FOLDER`.
+`FBDFG_PASS` and the download folder path `DOWNLOAD_FOLDER`. Optionally, the
+path of a persistent Firefox profile folder `FIREFOX_PROFILE` can be set, so
+that the login session is reused across runs, and `MAX_WORKERS` sets how many
+dataset types are downloaded at the same time when more than one is chosen,
+while `PARALLEL_DOWNLOADS` sets how many blocks of a dataset type are
+downloaded at the same time. Setting `HEADLESS=0` shows the browser window.
+The cookies of the login session are saved to `COOKIES_FILE` (by default
+`.fbdfg_cookies` in the home folder) and reused for one day. The verbosity
+of the log messages is set by `LOGLEVEL` (by default `INFO`), and
+`GECKODRIVER_PATH` pins the `geckodriver` executable instead of looking it up
+in the PATH.
 
 Last update: 2022-10-09
 """
 
 import os
+import re
+import sys
+import zipfile
+import threading
+import logging
+import argparse
+from datetime import datetime
 from pathlib import Path
-from time import time
+from time import perf_counter
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv, find_dotenv
 from bulk_downloader import Dataset
 
@@ -25,97 +43,304 @@ partner_id = os.environ.get("FBDFG_PID")
 username = os.environ.get("FBDFG_USER")
 password = os.environ.get("FBDFG_PASS")
 download_folder = os.environ.get("DOWNLOAD_FOLDER")
+profile_folder = os.environ.get("FIREFOX_PROFILE")
+# checked as positive integers by main()
+max_workers = os.environ.get("MAX_WORKERS", "2")
+parallel_downloads = os.environ.get("PARALLEL_DOWNLOADS", "1")
+headless = os.environ.get("HEADLESS", "1") != "0"
+log_level = os.environ.get("LOGLEVEL", "INFO")
+driver_path = os.environ.get("GECKODRIVER_PATH")
+# the cookies are kept out of the download folder, which may be shared
+cookies_file = os.environ.get("COOKIES_FILE", str(Path.home() / ".fbdfg_cookies"))
 
-starting_url = f"https://partners.facebook.com/data_for_good/data/?partner_id={partner_id}"
-ds_choices = ["Italy Coronavirus Disease Prevention Map Feb 24 2020 Id"]
-dst_choices = [
+DS_CHOICES = ("Italy Coronavirus Disease Prevention Map Feb 24 2020 Id",)
+DST_CHOICES = (
     "[Discontinued] Facebook Population (Administrative Regions) v1",
     "[Discontinued] Facebook Population (Tile Level) v1",
     "[Discontinued] Movement Between Administrative Regions v1",
     "[Discontinued] Movement Between Tiles v1",
     "[Discontinued] Colocation"
-]
+)
+# menus shown to the user, built once
+ds_menu = "\n".join(f"[{i}] {ds_choice}" for i, ds_choice in enumerate(DS_CHOICES))
+dst_menu = "\n".join(f"[{i}] {dst_choice}" for i, dst_choice in enumerate(DST_CHOICES))
 
-def main():
-    print("Welcome to the Meta Data for Good Coronavirus Data Bulk Downloader.")
-    print("Please select the dataset of your choice:")
-    
-    for i, ds_choice in enumerate(ds_choices):
-        print(f"[{i}]", ds_choice)
+logger = logging.getLogger("bulk_downloader")
 
-    user_ds_choice = int(input("Your choice: "))
+# the browsers of the dataset types downloaded at the same time log in one at
+# a time, so that the first one saves the cookies and the others restore them
+login_lock = threading.Lock()
 
-    if (user_ds_choice < len(ds_choices)):
-        search_term = ds_choices[user_ds_choice]
-    else:
-        print("Please enter a valid option.")
-        exit()
+# dates in the names of the downloaded files (i.e. `..._2020-03-01_0800.csv`)
+date_pattern = re.compile(r"\d{4}-\d{2}-\d{2}")
 
-    print("Please now select the dataset type of your choice:")
+def downloaded_dates(file_paths: list) -> frozenset:
+    """
+    Collect the dates that appear in the names of the downloaded files and, for
+    zip archives, in the names of the files that they contain. Incomplete
+    downloads (`.part` files), unreadable archives and strings that only look
+    like dates (i.e. `2020-13-45`) are ignored.
+    """
+    names = []
+    for file_path in file_paths:
+        file_path = str(file_path)
+        if file_path.endswith(".part"):
+            continue
+        names.append(os.path.basename(file_path))
+        if file_path.endswith(".zip"):
+            try:
+                with zipfile.ZipFile(file_path) as archive:
+                    names.extend(archive.namelist())
+            except zipfile.BadZipFile:
+                pass
+    dates = set()
+    for name in names:
+        for date in date_pattern.findall(name):
+            try:
+                dates.add(datetime.fromisoformat(date))
+            except ValueError:
+                # i.e. a version or an id that only looks like a date
+                pass
+    return frozenset(dates)
 
-    for i, dst_choice in enumerate(dst_choices):
-        print(f"[{i}]", dst_choice)
-    
-    user_dst_choice = int(input("Your choice: "))
+def folder_bytes(folder: Path, exclude: set = frozenset()) -> int:
+    """
+    Compute the total size in bytes of the files in `folder`, leaving out the
+    files whose names are in `exclude`. Links are not followed.
+    """
+    with os.scandir(folder) as entries:
+        return sum(
+            e.stat(follow_symlinks=False).st_size for e in entries
+            if e.name not in exclude and e.is_file(follow_symlinks=False)
+        )
 
-    if (user_dst_choice < len(dst_choices)):
-        dataset_type = dst_choices[user_dst_choice]
-    else:
+def positive_int(value: str) -> int:
+    """
+    Parse a strictly positive integer from the command line, i.e. the size of
+    the blocks.
+    """
+    try:
+        number = int(value)
+    except ValueError:
+        number = 0
+    if number <= 0:
+        raise argparse.ArgumentTypeError(f"{value!r} is not a positive integer")
+    return number
+
+def ask_block_size() -> int:
+    """
+    Ask the user the size of the blocks for the bulk download, in days.
+    """
+    print("Choose the size of the block for the bulk download (choose an integer):")
+    try:
+        return positive_int(input("Your choice: "))
+    except argparse.ArgumentTypeError:
         print("Please enter a valid option.")
         exit()
 
+def build_parser() -> argparse.ArgumentParser:
+    """
+    Build the parser of the command line arguments. Every choice that is not
+    passed as an argument is asked interactively.
+    """
+    parser = argparse.ArgumentParser(
+        description="Bulk download datasets from the Meta Data for Good platform."
+    )
+    parser.add_argument("--dataset-idx", type=int,
+        help="index of the dataset in the list of datasets")
+    dataset_type_group = parser.add_mutually_exclusive_group()
+    dataset_type_group.add_argument("--dataset-type-idx", type=int, nargs="+",
+        help="indices of the dataset types in the list of dataset types")
+    dataset_type_group.add_argument("--all", action="store_true",
+        help="download all the dataset types")
+    parser.add_argument("--block-size", type=positive_int,
+        help="size of the blocks for the bulk download, in days")
+    parser.add_argument("--from", dest="date_from", type=datetime.fromisoformat,
+        help="first date to be downloaded (YYYY-MM-DD)")
+    parser.add_argument("--to", dest="date_to", type=datetime.fromisoformat,
+        help="last date to be downloaded (YYYY-MM-DD)")
+    return parser
+
+def build_starting_url() -> str:
+    """
+    Build the URL of the Meta Data for Good webpage of the partner, once the
+    required environment variables have been checked.
+    """
+    return f"https://partners.facebook.com/data_for_good/data/?partner_id={partner_id}"
+
+def download_dataset(starting_url: str, search_term: str, dataset_type: str,
+    block_size: int = None, profile_folder: str = None, date_from: datetime = None,
+    date_to: datetime = None):
+    """
+    Log into the Meta Data for Good platform with a new browser, look up the
+    dataset and download its available dates between `date_from` and `date_to`
+    (by default all of them) in blocks of `block_size` days. If `block_size` is
+    not given, the user is asked to choose it once the available dates have
+    been scanned.
+    """
     dest_folder = Path(download_folder) / "raw" / search_term / dataset_type
     dest_folder.mkdir(parents=True, exist_ok=True)
 
+    # If a persistent Firefox profile has been chosen, the session of the
+    # previous runs is reused
+    profile_path = None
+    if profile_folder is not None:
+        profile_path = Path(profile_folder)
+        profile_path.mkdir(parents=True, exist_ok=True)
+        profile_path = str(profile_path.absolute())
+
     # Let us define the Dataset object for the dataset that we want to scrape
-    ds = Dataset(starting_url, str(dest_folder.absolute()))
-    # Let us navigate into the website and log in with our credentials
-    start = time()
-    print(f"[LOG] Logging in the Meta Data for Good platform... ({time() - start:.2f} s)")
-    ds.allow_cookies()
-    ds.visit_login()
-    ds.allow_cookies()
-    ds.perform_login(username=username, password=password)
-
-    # Now we look for the dataset of our interest and open the download
-    # dialog box
-    print(f"[LOG] Looking up for the desired search term / dataset... ({time() - start:.2f} s)")
-    ds.filter_ds(search_term, dataset_type)
-    ds.open_dl_dialog()
-
-    # Let us open the calendar and explore the available dates
-    print(f"[LOG] Scanning available dates ({time() - start:.2f} s)")
-    ds.open_calendar()
-    available_dates = ds.scan_all_dates()
-    print(f"\nREPORT ({time() - start:.2f} s)\n================")
-    print(f"There are {len(available_dates)} avilable dates between {min(available_dates).strftime('%Y-%m-%d')} and {max(available_dates).strftime('%Y-%m-%d')}\n")
-    ds.send_escape()
-    ds.send_escape()
-
-    # Given the informations about the cardinality of the dataset, the size of
-    # the blocks for the download have to be chosen
-    print("Choose the size of the block for the bulk download (choose an integer):")
-    block_size = int(input("Your choice: "))
+    ds = Dataset(starting_url, str(dest_folder.absolute()), profile_path, headless, driver_path)
+    # the browser is closed even when something goes wrong, so that no
+    # Firefox and geckodriver processes are left behind
+    try:
+        # Let us navigate into the website and log in with our credentials
+        start = perf_counter()
+        with login_lock:
+            ds.load_cookies(cookies_file)
+            if ds.is_logged_in():
+                logger.info("Already logged in the Meta Data for Good platform")
+            else:
+                logger.info("Logging in the Meta Data for Good platform...")
+                ds.allow_cookies()
+                ds.visit_login()
+                ds.allow_cookies()
+                ds.perform_login(username=username, password=password)
+                ds.save_cookies(cookies_file)
+
+        # Now we look for the dataset of our interest and open the download
+        # dialog box
+        logger.info("Looking up for the desired search term / dataset...")
+        ds.filter_ds(search_term, dataset_type)
+        ds.open_dl_dialog()
+
+        # Let us open the calendar and explore the available dates
+        logger.info("Scanning available dates...")
+        ds.open_calendar()
+        # the results of the previous scans are cached in the download folder
+        available_dates = ds.scan_all_dates(str(dest_folder / ".available_dates.json"))
+        print(f"\nREPORT: {dataset_type} ({perf_counter() - start:.2f} s)\n================")
+        print(f"There are {len(available_dates)} avilable dates between {min(available_dates).strftime('%Y-%m-%d')} and {max(available_dates).strftime('%Y-%m-%d')}\n")
+        ds.send_escape(2)
+
+        # Given the informations about the cardinality of the dataset, the size of
+        # the blocks for the download have to be chosen
+        if block_size is None:
+            block_size = ask_block_size()
     
-    # What is the size of the folder?
-    start_size = 0
-    for e in os.scandir(dest_folder):
-        start_size += os.path.getsize(e)
+        # Which files are already in the folder, and which dates do they cover?
+        with os.scandir(dest_folder) as entries:
+            start_paths = {e.name: e.path for e in entries if e.is_file()}
+        start_names = set(start_paths)
+        skip_dates = downloaded_dates(start_paths.values())
 
-    # Now start iteratively downloading the datasets
-    ds.download_iteration(block_size)
+        # Now start iteratively downloading the datasets, skipping the blocks that
+        # have already been downloaded
+        failed_blocks = ds.download_iteration(block_size, parallel_downloads, date_from, date_to, skip_dates)
 
-    # What is the final size of the folder?
-    end_size = 0
-    for e in os.scandir(dest_folder):
-        end_size += os.path.getsize(e)
+        # What is the size of the new files? (only their entries are stat()ed)
+        downloaded_size = folder_bytes(dest_folder, exclude=start_names)
+
+        if failed_blocks:
+            print("DOWNLOAD INCOMPLETE!")
+            print("====================")
+            for current_date, next_date in failed_blocks:
+                print(f"The data between {next_date.strftime('%Y-%m-%d')} and {current_date.strftime('%Y-%m-%d')} could not be downloaded.")
+            print("Run the script again to download the missing blocks.")
+        else:
+            print("DOWNLOAD COMPLETE!")
+            print("==================")
+        print(f"The data has been saved in {str(dest_folder)}.")
+        print(f"{downloaded_size/1024/1024:.0f} MB of data were downloaded in total.")
+    finally:
+        ds.browser.quit()
+
+def main():
+    parser = build_parser()
+    args = parser.parse_args()
+    if args.date_from is not None and args.date_to is not None and args.date_from > args.date_to:
+        parser.error("--from must not be later than --to")
+    # log messages carry the time elapsed since the start of the script
+    logging.basicConfig(
+        level=log_level, format="[LOG] %(relativeCreated)d ms - %(threadName)s - %(message)s"
+    )
+    # without these variables every run would hit a broken URL or fail late
+    missing_variables = [
+        name for name, value in [("FBDFG_PID", partner_id), ("FBDFG_USER", username),
+            ("FBDFG_PASS", password), ("DOWNLOAD_FOLDER", download_folder)]
+        if not value
+    ]
+    if missing_variables:
+        print(f"Please set {', '.join(missing_variables)} in the .env file.")
+        exit()
+    # with no download slot the downloads would wait for one until they time out
+    global max_workers, parallel_downloads
+    try:
+        max_workers = positive_int(max_workers)
+        parallel_downloads = positive_int(parallel_downloads)
+    except argparse.ArgumentTypeError:
+        print("Please set MAX_WORKERS and PARALLEL_DOWNLOADS to positive integers in the .env file.")
+        exit()
+    starting_url = build_starting_url()
+    if args.all:
+        args.dataset_type_idx = list(range(len(DST_CHOICES)))
+    # without a terminal the choices cannot be asked, so they are required
+    if not sys.stdin.isatty():
+        for option, value in [("--dataset-idx", args.dataset_idx),
+            ("--dataset-type-idx", args.dataset_type_idx), ("--block-size", args.block_size)]:
+            if value is None:
+                parser.error(f"{option} is required when not running interactively")
+
+    print("Welcome to the Meta Data for Good Coronavirus Data Bulk Downloader.")
+
+    user_ds_choice = args.dataset_idx
+    if user_ds_choice is None:
+        print("Please select the dataset of your choice:")
+        print(ds_menu)
+        user_ds_choice = int(input("Your choice: "))
+
+    if (0 <= user_ds_choice < len(DS_CHOICES)):
+        search_term = DS_CHOICES[user_ds_choice]
+    else:
+        print("Please enter a valid option.")
+        exit()
+
+    user_dst_choices = args.dataset_type_idx
+    if user_dst_choices is None:
+        print("Please now select the dataset type of your choice (separate multiple choices with commas):")
+        print(dst_menu)
+        user_dst_choices = [int(choice) for choice in input("Your choice: ").split(",")]
+    # a dataset type chosen twice would be downloaded twice at the same time
+    user_dst_choices = list(dict.fromkeys(user_dst_choices))
+
+    if all(0 <= user_dst_choice < len(DST_CHOICES) for user_dst_choice in user_dst_choices):
+        dataset_types = [DST_CHOICES[user_dst_choice] for user_dst_choice in user_dst_choices]
+    else:
+        print("Please enter a valid option.")
+        exit()
 
-    print("DOWNLOAD COMPLETE!")
-    print("==================")
-    print(f"The data has been saved in {str(dest_folder)}.")
-    print(f"{end_size/1024/1024:.0f} MB of data were downloaded in total.")
+    block_size = args.block_size
+    if len(dataset_types) == 1:
+        download_dataset(starting_url, search_term, dataset_types[0], block_size, profile_folder,
+            args.date_from, args.date_to)
+        return
 
-    ds.browser.quit()
+    # Several dataset types are downloaded at the same time, each one with its
+    # own browser (and its own profile, since a profile cannot be shared by
+    # running browsers), so the size of the blocks is chosen up front
+    if block_size is None:
+        block_size = ask_block_size()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(
+                download_dataset, starting_url, search_term, dataset_type, block_size,
+                None if profile_folder is None else str(Path(profile_folder) / str(user_dst_choice)),
+                args.date_from, args.date_to
+            )
+            for user_dst_choice, dataset_type in zip(user_dst_choices, dataset_types)
+        ]
+        for future in futures:
+            future.result()
 
 if __name__ == "__main__":
     main()